@@ -54,6 +54,7 @@ async def main():
             df.to_csv(f"output/properties-{city_id}.csv", index=False)
 
             print(f"Fetched {len(prop_data)} listings in City {city_id}.")
+            print(f"Quarantined {api.profiler.rows_quarantined} listings in City {city_id}.")
 
         except aiohttp.ClientResponseError as e:
             print(f"\nAPI Error: Status {e.status} - {e.message}")
@@ -1,9 +1,18 @@
 from patchright.async_api import async_playwright
+import os
 import json
 import time
 import asyncio
+import logging
 import pandas as pd
-from typing import List, Callable, Union
+from typing import List, Dict, Callable, Optional, Union, Any
+
+from services.archive import ResponseArchive
+from services.quality import DataQualityProfiler
+
+logging.basicConfig(level=logging.WARNING)
+log = logging.getLogger(__name__)
+
 
 class NNAcresProperty(dict):
     @staticmethod
@@ -20,6 +29,8 @@ class NNAcresProperty(dict):
             return 'New Construction'
         elif value == '3':
             return "10+ Years"
+        elif value == '4':
+            return '5 to 10 years'
         elif value == '':
             return None
         else:
@@ -28,6 +39,8 @@ class NNAcresProperty(dict):
     def _handle_possession_status(self, value: str = '') -> str:
         if value == 'I':
             return 'Ready to Move'
+        elif value == 'U':
+            return 'Under Construction'
         elif value == '':
             return None
         else:
@@ -94,92 +107,302 @@ class NNAcresProperty(dict):
             return 0
 
     def __init__(self, data: dict):
-        try:
-            self['_id'] = f"nna-{data.get('PROP_ID', '')}"
+        self['_id'] = f"nna-{data.get('PROP_ID', '')}"
+        self.spid = data.get('SPID')
+        self.url = data.get('PROP_DETAILS_URL')
 
-            self['Latitude'] = self._parse(data['MAP_DETAILS'].get('LATITUDE'), float)
-            self['Longitude'] = self._parse(data['MAP_DETAILS'].get('LONGITUDE'), float)
+        self['Latitude'] = self._parse(data['MAP_DETAILS'].get('LATITUDE'), float)
+        self['Longitude'] = self._parse(data['MAP_DETAILS'].get('LONGITUDE'), float)
 
-            self['Code_City'] = self._parse(data['location'].get('CITY'), str)
-            self['Name_City'] = self._parse(data['location'].get('CITY_NAME'), str)
-            self['Code_Locality'] = self._parse(data['location'].get('LOCALITY_ID'), str)
-            self['Name_Locality'] = self._parse(data['location'].get('LOCALITY_NAME'), str)
-            
-            self['Price'] = self._parse(data.get('MIN_PRICE'), int)
-            self['Price_SqFt'] = self._parse(float(data.get('PRICE_SQFT')), int)
-            self['Area_SqFt'] = self._parse(self._handle_area(data), int)
-
-            self['Status_Age_Construction'] = self._handle_age(data.get('AGE')) # Incomplete
-            self['Status_Possession_Status'] = self._handle_possession_status(data.get('AVAILABILITY')) # Incomplete
-            self['Status_Furnished'] = self._handle_furnish(data.get('FURNISH'))
-
-            self['Num_Bedroom'] = self._parse(data.get('BEDROOM_NUM'), int)
-            self['Num_Floor'] = self._handle_floor(data.get('FLOOR_NUM'))
-            self['Num_Floor_Total'] = self._parse(data.get('TOTAL_FLOOR'), int)
-            self['Num_Balcony'] = self._parse(data.get('BALCONY_NUM'), int)
-            self['Num_Bathroom'] = self._parse(data.get('BATHROOM_NUM'), int)
-            self['Num_Parking'] = self._handle_parking(data.get('RESERVED_PARKING'))
-            # self['Type_Flooring'] = self._handle_flooring(data.get('flooringTyD')) # Mentioned in TOP_USPS only if Vtrified
-
-            self['Code_Amenities'] = self._parse(data.get('FEATURES'), lambda x: x.split(','))
-            """
-            self['Name_Landmarks'] = self._parse(
-                data.get('landmarkDetails'), lambda x: [item.split('|')[1] for item in x if item]
-            )
-            self['Type_Property'] = data.get('propTypeD')
-            self['Type_Transaction'] = data.get('transactionTypeD')
-            """
+        self['Code_City'] = self._parse(data['location'].get('CITY'), str)
+        self['Name_City'] = self._parse(data['location'].get('CITY_NAME'), str)
+        self['Code_Locality'] = self._parse(data['location'].get('LOCALITY_ID'), str)
+        self['Name_Locality'] = self._parse(data['location'].get('LOCALITY_NAME'), str)
+        
+        self['Price'] = self._parse(data.get('MIN_PRICE'), int)
+        self['Price_SqFt'] = self._parse(float(data.get('PRICE_SQFT')), int)
+        self['Area_SqFt'] = self._parse(self._handle_area(data), int)
+
+        self['Status_Age_Construction'] = self._handle_age(data.get('AGE')) # Incomplete
+        self['Status_Possession_Status'] = self._handle_possession_status(data.get('AVAILABILITY')) # Incomplete
+        self['Status_Furnished'] = self._handle_furnish(data.get('FURNISH'))
+
+        self['Num_Bedroom'] = self._parse(data.get('BEDROOM_NUM'), int)
+        self['Num_Floor'] = self._handle_floor(data.get('FLOOR_NUM'))
+        self['Num_Floor_Total'] = self._parse(data.get('TOTAL_FLOOR'), int)
+        self['Num_Balcony'] = self._parse(data.get('BALCONY_NUM'), int)
+        self['Num_Bathroom'] = self._parse(data.get('BATHROOM_NUM'), int)
+        self['Num_Parking'] = self._handle_parking(data.get('RESERVED_PARKING'))
+        # self['Type_Flooring'] = self._handle_flooring(data.get('flooringTyD')) # Mentioned in TOP_USPS only if Vtrified
+
+        self['Code_Amenities'] = self._parse(data.get('FEATURES'), lambda x: x.split(','))
+        """
+        self['Name_Landmarks'] = self._parse(
+            data.get('landmarkDetails'), lambda x: [item.split('|')[1] for item in x if item]
+        )
+        self['Type_Property'] = data.get('propTypeD')
+        self['Type_Transaction'] = data.get('transactionTypeD')
+        """
  
-            self['Time_Scraped'] = int(time.time())
-            self['Time_Posted'] = int(data.get('POSTING_DATE', 0) / 1000)
+        self['Time_Scraped'] = int(time.time())
+        self['Time_Posted'] = int(data.get('POSTING_DATE', 0) / 1000)
 
+
+def extract_listings(data: Union[dict, List[dict]]) -> List[dict]:
+    # Shared by the live search and archive replay so both parse the same rows.
+    # Search API responses wrap the listings, initial page data is the bare list
+    items = data.get('properties', []) if isinstance(data, dict) else data
+    return [item for item in items if isinstance(item, dict) and 'SPID' in item]
+
+
+def parse_listings(data: Union[dict, List[dict]], profiler: DataQualityProfiler) -> List[NNAcresProperty]:
+    # Parses row by row so one bad listing is quarantined instead of losing the page
+    candidates = []
+    for item in extract_listings(data):
+        try:
+            candidates.append(NNAcresProperty(item))
         except Exception as e:
-            print(f"Error: {e}\nData:{data}")
-            raise e
+            profiler.quarantine_error(item, e)
+
+    return candidates
+
+
+class NNAcresDetail(NNAcresProperty):
+    """
+    Fields read from a listing's detail page record, keyed like NNAcresProperty.
+
+    The record uses the same schema as the search results (AGE and AVAILABILITY codes,
+    TOP_USPS), so the listing handlers are reused. Only fields the page provided are kept.
+    """
+    @staticmethod
+    def _handle_flooring(value: Union[List, None]) -> Union[List[str], None]:
+        # Flooring only shows up as a USP, e.g. "Vitrified Flooring"
+        if not value:
+            return None
+
+        texts = [item if isinstance(item, str) else ' '.join(str(v) for v in item.values()) for item in value if item]
+        flooring = [t.replace('Flooring', '').replace('flooring', '').strip() for t in texts if 'flooring' in t.lower()]
+        return flooring or None
+
+    def __init__(self, data: dict):
+        self['Type_Flooring'] = self._handle_flooring(data.get('TOP_USPS'))
+        self['Status_Age_Construction'] = self._handle_age(data.get('AGE', ''))
+        self['Status_Possession_Status'] = self._handle_possession_status(data.get('AVAILABILITY', ''))
+
+        # Listing values aren't overwritten with None
+        for key in [k for k, v in self.items() if v is None]:
+            del self[key]
 
 
 class NNAcresService:
     BASE_URL = "https://www.99acres.com"
 
-    def __init__(self):
+    def __init__(
+        self,
+        archive: Optional[ResponseArchive] = None,
+        profiler: Optional[DataQualityProfiler] = None,
+        max_concurrent: int = 10,
+        cache_path: str = "output/99acres-enriched.json",
+        retry_after: int = 7 * 24 * 3600,
+    ):
         self.listings: List[dict] = []
+        self._archive = archive
+        self.profiler = profiler or DataQualityProfiler()
+
+        # Shared between search and enrichment so both count against the same limit
+        self._limiter = asyncio.Semaphore(max_concurrent)
+        self._playwright = None
+        self._browser = None
+        self._context = None
+        self._context_lock = asyncio.Lock()
+
+        self._cache_path = cache_path
+        self._retry_after = retry_after
+        self._cache: Dict[str, Dict[str, Any]] = self._load_cache()
+
+    def _load_cache(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self._cache_path):
+            return {}
+
+        try:
+            with open(self._cache_path) as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            log.error(f"Ignoring unreadable enrichment cache {self._cache_path}: {e}")
+            return {}
+
+    def _is_cached(self, spid: str) -> bool:
+        # Failed or empty lookups are cached as {'_failed_at': ...} and retried once `retry_after` has passed
+        entry = self._cache.get(spid)
+        if entry is None:
+            return False
+
+        return time.time() - entry.get('_failed_at', time.time()) < self._retry_after
+
+    def _save_cache(self) -> None:
+        os.makedirs(os.path.dirname(self._cache_path) or ".", exist_ok=True)
+
+        # Write then rename so an interrupted save never leaves a truncated cache behind
+        tmp_path = f"{self._cache_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._cache, f)
+        os.replace(tmp_path, self._cache_path)
+
+    async def _get_context(self):
+        if self._context is not None:
+            return self._context
+
+        # Many lookups may arrive here at once; only the first launches the browser
+        async with self._context_lock:
+            if self._context is None:
+                log.info("Launching browser.")
+                self._playwright = await async_playwright().start()
+                self._browser = await self._playwright.chromium.launch(headless=False)
+                context = await self._browser.new_context()
+
+                await context.route("**/*", lambda route, request: route.abort()
+                    if request.resource_type in ["image", "font"]
+                    else route.continue_())
+
+                self._context = context
+
+        return self._context
+
+    async def close(self):
+        if self._context is not None:
+            log.info("Closing browser.")
+            await self._context.close()
+            await self._browser.close()
+            await self._playwright.stop()
+            self._playwright = self._browser = self._context = None
+
+    async def __aenter__(self):
+        await self._get_context()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def _fetch_detail(self, spid: str, url: str) -> NNAcresDetail:
+        context = await self._get_context()
+
+        async with self._limiter:
+            page = await context.new_page()
+            try:
+                await page.goto(url if url.startswith("http") else f"{self.BASE_URL}{url}", wait_until="domcontentloaded")
+                data = await self._read_initial_data(page)
+            finally:
+                await page.close()
+
+        detail = self._find_listing(data, spid)
+        if detail is None:
+            raise ValueError(f"Listing {spid} not found on its detail page")
+
+        return NNAcresDetail(detail)
+
+    @classmethod
+    def _find_listing(cls, data: Any, spid: str) -> Optional[dict]:
+        # Detail page layout varies, so search the initial data for the record carrying this SPID
+        if isinstance(data, dict):
+            if str(data.get('SPID')) == spid:
+                return data
+            children = data.values()
+        elif isinstance(data, list):
+            children = data
+        else:
+            return None
+
+        for child in children:
+            found = cls._find_listing(child, spid)
+            if found is not None:
+                return found
+
+        return None
+
+    async def post_processing(self, properties: List[NNAcresProperty], batch_size: int = 50) -> List[NNAcresProperty]:
+        """
+        Enrich listings with fields from their detail pages.
+
+        :param properties: Listings to enrich in place.
+        :param batch_size: Number of detail pages fetched before the cache is saved.
+        :return: The enriched listings.
+        """
+
+        # One lookup per SPID, skipping listings already enriched in an earlier run.
+        # Detail URLs are slugs ending in the SPID, so listings without PROP_DETAILS_URL are skipped
+        pending: Dict[str, str] = {}
+        for prop in properties:
+            spid = getattr(prop, 'spid', None)
+            url = getattr(prop, 'url', None)
+            if spid is not None and url and not self._is_cached(str(spid)):
+                pending.setdefault(str(spid), url)
+
+        log.info(f"Enriching {len(pending)} listings ({len(properties) - len(pending)} cached or without SPID/URL)")
+
+        spids = list(pending)
+        for i in range(0, len(spids), batch_size):
+            batch = spids[i:i + batch_size]
+            results = await asyncio.gather(*[self._fetch_detail(spid, pending[spid]) for spid in batch], return_exceptions=True)
+
+            for spid, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    log.error(f"Failed to enrich listing {spid}: {result}")
+                    self._cache[spid] = {'_failed_at': int(time.time())}
+                elif not result:
+                    log.warning(f"Detail page for listing {spid} yielded no known fields")
+                    self._cache[spid] = {'_failed_at': int(time.time())}
+                else:
+                    self._cache[spid] = dict(result)
 
-    async def post_processing(self, properties: List[NNAcresProperty]) -> List[NNAcresProperty]:
-        semaphore = asyncio.Semaphore(10)
+            self._save_cache()
+
+        for prop in properties:
+            entry = self._cache.get(str(getattr(prop, 'spid', None)), {})
+            prop.update({k: v for k, v in entry.items() if not k.startswith('_')})
+
+        return properties
 
     async def _handle_response(self, response):
         if "/api-aggregator/discovery/srp/search" in response.url and response.status == 200:
-            resp = await response.json()
-            await self._sanitise_data(resp)
+            body = await response.body()
+            if self._archive is not None:
+                await self._archive.append_async(body)
 
-    async def _get_initial_data(self, page) -> None:
+            await self._sanitise_data(json.loads(body))
+
+    async def _read_initial_data(self, page) -> dict:
         resp_raw = await page.evaluate('''() => {
             const scripts = Array.from(document.querySelectorAll('script'));
             const target = scripts.find(script => script.textContent.includes('window.__initialData__'));
             return target ? target.textContent : null;
         }''')
-        
-        resp = json.loads(
+
+        if resp_raw is None:
+            raise ValueError(f"No initial data found on {page.url}")
+
+        return json.loads(
             resp_raw.replace('window.__initialData__=', '').replace('; window.__masked__ = false', '')
-        )['srp']['pageData'].get('properties', [])
+        )
+
+    async def _get_initial_data(self, page) -> None:
+        resp = (await self._read_initial_data(page))['srp']['pageData'].get('properties', [])
+        if self._archive is not None:
+            await self._archive.append_async(json.dumps(resp).encode())
+
         await self._sanitise_data(resp)
 
-    async def _sanitise_data(self, data: List[dict]) -> int:
+    async def _sanitise_data(self, data: Union[dict, List[dict]]) -> int:
         # Converts each property dict to NNAcresProperty. Avoid project listings
-        candidates = [NNAcresProperty(item) for item in data if 'SPID' in item]
+        candidates = self.profiler.validate(parse_listings(data, self.profiler))
         self.listings.extend(candidates)
 
         return len(candidates)
 
-    async def search_page(self) -> None:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=False)
-            context = await browser.new_context()
+    async def search_page(self) -> List[NNAcresProperty]:
+        context = await self._get_context()
+
+        async with self._limiter:
             page = await context.new_page()
-            
-            await page.route("**/*", lambda route, request: route.abort()
-                if request.resource_type in ["image", "font"]
-                else route.continue_())
 
             await page.goto(self.BASE_URL)
             await page.wait_for_url("**/search/property/**", timeout=0, wait_until="documentloaded")
@@ -191,16 +414,16 @@ class NNAcresService:
             page.on("response", self._handle_response)
             
             await asyncio.sleep(5)
-            await context.close()
-            await browser.close()
+            await page.close()
 
-            return self.listings
+        return self.listings
 
 
 if __name__ == "__main__":
     async def main():
-        service = NNAcresService()
-        prop_data = await service.search_page()
+        async with NNAcresService() as service:
+            prop_data = await service.search_page()
+            prop_data = await service.post_processing(prop_data)
 
         df = pd.DataFrame(prop_data)
         df.to_csv(f"output/nnnacres-{int(time.time())}.csv", index=False)
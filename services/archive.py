@@ -0,0 +1,231 @@
+import os
+import json
+import mmap
+import time
+import uuid
+import struct
+import asyncio
+import logging
+import importlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional, Iterator, Tuple, Any
+
+import zstandard
+
+from services.quality import DataQualityProfiler
+
+logging.basicConfig(level=logging.WARNING)
+log = logging.getLogger(__name__)
+
+# Index entry per archived body: frame offset, frame length, fetch time (unix seconds)
+INDEX_ENTRY = struct.Struct("<QIq")
+
+
+class ResponseArchive:
+    """
+    Append-only archive of raw response bodies.
+
+    Each body is written as one zstd frame to `<source>-<run>-<n>.zst`, with its
+    offset, length and fetch time recorded in the matching `.idx` file.
+    A new segment is started once the current one reaches `max_segment_bytes`.
+    The run id is unique per archive, so concurrent writers never share a segment.
+    """
+
+    def __init__(self, directory: str, source: str, max_segment_bytes: int = 256 * 1024 * 1024, level: int = 3):
+        self.directory = directory
+        self.source = source
+        self.max_segment_bytes = max_segment_bytes
+        self._compressor = zstandard.ZstdCompressor(level=level, write_content_size=True)
+
+        os.makedirs(directory, exist_ok=True)
+        self._run_id = f"{int(time.time()):010d}-{uuid.uuid4().hex[:8]}"
+        self._segment_no = 0
+        self._segment = None
+        self._index = None
+        self._offset = 0
+        self._lock = threading.Lock()
+
+    def _open_segment(self) -> None:
+        base = os.path.join(self.directory, f"{self.source}-{self._run_id}-{self._segment_no:05d}")
+        log.info(f"Opening archive segment {base}.zst")
+
+        # Exclusive create: fail loudly rather than interleave with another writer
+        self._segment = open(f"{base}.zst", "xb")
+        self._index = open(f"{base}.idx", "xb")
+        self._offset = 0
+
+    def _close_segment(self) -> None:
+        if self._segment is not None:
+            self._segment.close()
+            self._index.close()
+            self._segment = None
+            self._index = None
+
+    def append(self, body: bytes, fetched_at: Optional[int] = None) -> None:
+        fetched_at = fetched_at or int(time.time())
+
+        with self._lock:
+            if self._segment is None:
+                self._open_segment()
+            elif self._offset >= self.max_segment_bytes:
+                self._close_segment()
+                self._segment_no += 1
+                self._open_segment()
+
+            frame = self._compressor.compress(body)
+            self._segment.write(frame)
+            self._segment.flush()
+
+            # Index is written after the frame so a crash never indexes a partial frame
+            self._index.write(INDEX_ENTRY.pack(self._offset, len(frame), fetched_at))
+            self._index.flush()
+            self._offset += len(frame)
+
+    async def append_async(self, body: bytes) -> None:
+        """Archives a body from a worker thread so compression and disk writes stay off the event loop."""
+        await asyncio.to_thread(self.append, body, int(time.time()))
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_segment()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def segment_paths(directory: str, source: str) -> List[str]:
+    if not os.path.isdir(directory):
+        return []
+
+    names = sorted(n for n in os.listdir(directory) if n.startswith(f"{source}-") and n.endswith(".zst"))
+    return [os.path.join(directory, n) for n in names]
+
+
+def frame_count(path: str) -> int:
+    index_path = path[:-len(".zst")] + ".idx"
+    return os.path.getsize(index_path) // INDEX_ENTRY.size
+
+
+def read_segment(path: str, first: int = 0, last: Optional[int] = None) -> Iterator[Tuple[memoryview, int]]:
+    """
+    Yields (compressed frame, fetch time) for indexed frames `first` to `last` (exclusive) of a segment.
+    Frames are views into the memory-mapped segment, so nothing is copied until decompression.
+    """
+    index_path = path[:-len(".zst")] + ".idx"
+    with open(index_path, "rb") as f:
+        f.seek(first * INDEX_ENTRY.size)
+        index = f.read() if last is None else f.read((last - first) * INDEX_ENTRY.size)
+
+    # Ignore a trailing partial entry left by an interrupted write
+    index = index[:len(index) - len(index) % INDEX_ENTRY.size]
+    if not index:
+        return
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        view = memoryview(mm)
+        try:
+            for offset, length, fetched_at in INDEX_ENTRY.iter_unpack(index):
+                # Each view is only valid until the next frame is requested
+                frame = view[offset:offset + length]
+                try:
+                    yield frame, fetched_at
+                finally:
+                    frame.release()
+        finally:
+            view.release()
+
+
+# Replay uses the same row-by-row parser as the live services
+SOURCES = {
+    "magicbricks": "services.magicbricks",
+    "99acres": "services.99acres",
+}
+
+
+def _replay_chunk(source: str, path: str, first: int, last: int, quarantine_path: Optional[str]) -> Tuple[List[Dict], int, DataQualityProfiler]:
+    parse_listings = importlib.import_module(SOURCES[source]).parse_listings
+
+    # One spill file per worker process, so concurrent workers never append to the same file
+    profiler = DataQualityProfiler(quarantine_path=f"{quarantine_path}.{os.getpid()}" if quarantine_path else None)
+    decompressor = zstandard.ZstdDecompressor()
+
+    records, errors = [], 0
+    for frame, fetched_at in read_segment(path, first, last):
+        try:
+            body = json.loads(decompressor.decompress(frame))
+        except Exception as e:
+            errors += 1
+            log.error(f"Failed to replay frame from {path}: {e}")
+            continue
+
+        # Same parse and validation as the live crawl, one archived response per batch
+        for record in profiler.validate(parse_listings(body, profiler)):
+            record['Time_Scraped'] = fetched_at
+            records.append(dict(record))
+
+    return records, errors, profiler
+
+
+class ReplayEngine:
+    """
+    Re-runs the property normalisers over archived responses.
+    Segments are split into chunks of `chunk_frames` index entries, each replayed by a worker process.
+    Rows are validated as in the live crawl; the workers' results are merged into `profiler`.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        source: str,
+        max_workers: Optional[int] = None,
+        chunk_frames: int = 64,
+        quarantine_path: Optional[str] = None,
+    ):
+        if source not in SOURCES:
+            raise ValueError(f"Unknown archive source: {source}")
+
+        self.directory = directory
+        self.source = source
+        self.max_workers = max_workers
+        self.chunk_frames = chunk_frames
+        self.quarantine_path = quarantine_path
+        self.profiler = DataQualityProfiler()
+
+    def _chunks(self) -> List[Tuple[str, int, int]]:
+        chunks = []
+        for path in segment_paths(self.directory, self.source):
+            count = frame_count(path)
+            chunks.extend((path, first, min(first + self.chunk_frames, count)) for first in range(0, count, self.chunk_frames))
+        return chunks
+
+    def replay(self) -> List[Dict]:
+        chunks = self._chunks()
+        log.info(f"Replaying {len(chunks)} {self.source} chunks from {self.directory}...")
+
+        all_properties, total_errors = [], 0
+        with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+            args = [(self.source, path, first, last, self.quarantine_path) for path, first, last in chunks]
+            jobs = pool.map(_replay_chunk, *zip(*args)) if chunks else []
+            for (path, first, last), (records, errors, profiler) in zip(chunks, jobs):
+                log.info(f"Replayed {len(records)} properties from {path} [{first}:{last}] ({errors} failed frames, {profiler.rows_quarantined} quarantined rows)")
+                all_properties.extend(records)
+                total_errors += errors
+                self.profiler.merge(profiler)
+
+        log.info(f"Replay complete. Total properties: {len(all_properties)}, failed frames: {total_errors}, quarantined rows: {self.profiler.rows_quarantined}")
+        return all_properties
+
+
+if __name__ == "__main__":
+    import sys
+    import pandas as pd
+
+    source = sys.argv[1] if len(sys.argv) > 1 else "magicbricks"
+    prop_data = ReplayEngine("archive", source).replay()
+
+    df = pd.DataFrame(prop_data)
+    df.to_csv(f"output/replay-{source}-{int(time.time())}.csv", index=False)
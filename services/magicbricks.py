@@ -1,12 +1,16 @@
 import asyncio
 import aiohttp
-from typing import List, Dict, Optional, Callable, Union,Any
+from typing import List, Dict, Optional, Callable, Awaitable, Union, Any, Tuple
 from http.cookies import SimpleCookie
 import time
+import json
 import logging
 
 import pandas as pd
 
+from services.archive import ResponseArchive
+from services.quality import DataQualityProfiler
+
 logging.basicConfig(level=logging.WARNING)
 log = logging.getLogger(__name__)
 
@@ -119,12 +123,39 @@ class MagicBricksProperty(dict):
         return f"<Property id={self['_id']} city='{self['Code_City']}' price='{self['Price']}' area='{self['Area_SqFt']}' sqFtPrice='{self['Price_SqFt']}' bedrooms='{self['Num_Bedroom']}' floor='{self['Num_Floor']}' totalFloors='{self['Num_Floor_Total']}'>"
 
 
+def extract_listings(resp_data: Any) -> List[Dict]:
+    # Shared by the live search and archive replay so both parse the same rows
+    if not isinstance(resp_data, dict) or not isinstance(resp_data.get("resultList"), list):
+        return []
+    return resp_data["resultList"]
+
+
+def parse_listings(resp_data: Any, profiler: DataQualityProfiler) -> List[MagicBricksProperty]:
+    # Parses row by row so one bad listing is quarantined instead of losing the page
+    properties = []
+    for data in extract_listings(resp_data):
+        try:
+            properties.append(MagicBricksProperty(data))
+        except Exception as e:
+            profiler.quarantine_error(data, e)
+
+    return properties
+
+
 class MagicBricksService:
     BASE_URL = "https://www.magicbricks.com"
 
-    def __init__(self, connector: Optional[aiohttp.TCPConnector] = None):
+    def __init__(
+        self,
+        connector: Optional[aiohttp.TCPConnector] = None,
+        archive: Optional[ResponseArchive] = None,
+        profiler: Optional[DataQualityProfiler] = None,
+    ):
         self._connector = connector
+        self._archive = archive
+        self.profiler = profiler or DataQualityProfiler()
         self._session: Optional[aiohttp.ClientSession] = None
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
 
     async def _get_session(self) -> aiohttp.ClientSession:
         if self._session is None or self._session.closed:
@@ -179,7 +210,40 @@ class MagicBricksService:
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         await self.close()
 
+    @staticmethod
+    def _request_key(method: str, url: str, params: Optional[Dict[str, Any]]) -> Tuple:
+        items = tuple(sorted((str(k), str(v)) for k, v in (params or {}).items()))
+        return (method.upper(), url, items)
+
+    @staticmethod
+    def _retrieve_exception(future: asyncio.Future) -> None:
+        # Marks the error as retrieved in case every caller was cancelled before it arrived
+        if not future.cancelled():
+            future.exception()
+
+    async def _single_flight(self, key: Tuple, factory: Callable[[], Awaitable[Any]]) -> Any:
+        # Identical in-flight calls share one future
+        future = self._inflight.get(key)
+        if future is not None:
+            log.debug(f"Joining in-flight call {key}")
+        else:
+            future = asyncio.ensure_future(factory())
+            self._inflight[key] = future
+            future.add_done_callback(lambda f, k=key: self._inflight.pop(k, None))
+            future.add_done_callback(self._retrieve_exception)
+
+        # Shielded so one cancelled caller does not cancel the call for the others
+        return await asyncio.shield(future)
+
     async def _request(self, method: str, url: str, **kwargs) -> Dict[str, Any]:
+        # Single-flight: identical in-flight GETs share one underlying request
+        if method.upper() != "GET" or set(kwargs) - {"params"}:
+            return await self._send(method, url, **kwargs)
+
+        key = self._request_key(method, url, kwargs.get('params'))
+        return await self._single_flight(key, lambda: self._send(method, url, **kwargs))
+
+    async def _send(self, method: str, url: str, **kwargs) -> Dict[str, Any]:
         session = await self._get_session()
         log.debug(f"Making {method.upper()} request to {url} with params: {kwargs.get('params')}")
         try:
@@ -188,7 +252,11 @@ class MagicBricksService:
 
                 content_type = response.headers.get('Content-Type', '')
                 if 'application/json' in content_type:
-                    data = await response.json()
+                    body = await response.read()
+                    if self._archive is not None:
+                        await self._archive.append_async(body)
+
+                    data = json.loads(body)
                     log.debug(f"Received JSON response from {url}")
                     return data
                 else:
@@ -204,7 +272,7 @@ class MagicBricksService:
             log.error(f"An unexpected error occurred during request: {e}", exc_info=True)
             raise
 
-    async def search_page(self, city_code: str, page: int = 1, **kwargs: Any) -> List[MagicBricksProperty]:
+    async def _search_page(self, city_code: str, page: int = 1, **kwargs: Any) -> Tuple[List[MagicBricksProperty], int, int]:
         params = {
             "editSearch": "Y",
             "category": "S", # S = Sale, R = Rent
@@ -220,19 +288,32 @@ class MagicBricksService:
         }
 
         url = f"{self.BASE_URL}/mbsrp/propertySearch.html"
+
+        # Identical searches share one parsed and validated page, so the profiler counts its rows once
+        key = ("search",) + self._request_key("GET", url, params)
+        return await self._single_flight(key, lambda: self._fetch_search_page(url, params, city_code, page))
+
+    async def _fetch_search_page(self, url: str, params: Dict[str, Any], city_code: str, page: int) -> Tuple[List[MagicBricksProperty], int, int]:
         log.info(f"Searching page {page} for city {city_code}...")
 
         resp_data = await self._request("GET", url, params=params)
 
-        if "resultList" not in resp_data or not isinstance(resp_data["resultList"], list):
+        if not isinstance(resp_data.get("resultList"), list):
              log.warning(f"Unexpected response structure from search API: 'resultList' missing or not a list. Keys: {resp_data.keys()}")
-             return []
+             return [], 0, 30
         
-        self.result_count: int = resp_data["editAdditionalDataBean"].get("resultCount", 0)
-        self.result_per_page: int = resp_data["editAdditionalDataBean"].get("resultPerPageCount", 30)
+        result_count: int = resp_data["editAdditionalDataBean"].get("resultCount", 0)
+        result_per_page: int = resp_data["editAdditionalDataBean"].get("resultPerPageCount", 30)
+
+        log.info(f"Found {result_count} properties on page {page} for city {city_code}.")
 
-        log.info(f"Found {self.result_count} properties on page {page} for city {city_code}.")
-        return [MagicBricksProperty(data) for data in resp_data["resultList"]]
+        # Rows that fail to parse or validate are quarantined rather than failing the page
+        properties = parse_listings(resp_data, self.profiler)
+        return self.profiler.validate(properties), result_count, result_per_page
+
+    async def search_page(self, city_code: str, page: int = 1, **kwargs: Any) -> List[MagicBricksProperty]:
+        properties, _, _ = await self._search_page(city_code=city_code, page=page, **kwargs)
+        return properties
     
     async def search(self, city_code: str, max_concurrent: int = 25, **kwargs: Any) -> List[MagicBricksProperty]:
         """
@@ -243,18 +324,18 @@ class MagicBricksService:
         :return: A list of Property objects.
         """
 
-        page_one = await self.search_page(city_code=city_code, page=1, **kwargs)
-        result_pages = (self.result_count + self.result_per_page - 1) // self.result_per_page
+        # Pagination state is kept per call so concurrent searches on one service don't clash
+        page_one, result_count, result_per_page = await self._search_page(city_code=city_code, page=1, **kwargs)
+        result_pages = (result_count + result_per_page - 1) // result_per_page
         log.info(f"Total pages to fetch for city {city_code}: {result_pages}")
 
         tasks = []
         semaphore = asyncio.Semaphore(max_concurrent)
 
-        for page in range(1, result_pages + 1):
+        for page in range(2, result_pages + 1):
             async def task(pn=page, cc=city_code):
                 async with semaphore:
-                    data, _ = await self.search_page(city_code=cc, page=pn)
-                    return data
+                    return await self.search_page(city_code=cc, page=pn, **kwargs)
 
             tasks.append(task())
 
@@ -262,7 +343,7 @@ class MagicBricksService:
         all_properties = page_one.copy() if page_one else []
 
         for i, result in enumerate(results_list):
-            page = i + 1
+            page = i + 2
 
             if isinstance(result, Exception):
                 log.error(f"Failed to fetch page {page} for city {city_code}: {result}")
@@ -0,0 +1,227 @@
+import json
+import logging
+from typing import List, Dict, Optional, Tuple, Any
+
+import numpy as np
+
+logging.basicConfig(level=logging.WARNING)
+log = logging.getLogger(__name__)
+
+# (min, max) accepted for each numeric column. Nulls are tracked separately, not quarantined
+RANGES: Dict[str, Tuple[float, float]] = {
+    'Price': (1e5, 1e10),
+    'Price_SqFt': (500, 2e5),
+    'Area_SqFt': (50, 1e5),
+    'Num_Bedroom': (0, 10),
+    'Num_Bathroom': (0, 10),
+    'Num_Floor': (-2, 200),
+    'Num_Floor_Total': (0, 200),
+    'Num_Balcony': (0, 10),
+    'Num_Parking': (0, 20),
+}
+
+# (lat_min, lat_max, long_min, long_max)
+INDIA_BOUNDS: Tuple[float, float, float, float] = (6.0, 37.5, 68.0, 97.5)
+
+EARTH_RADIUS_KM = 6371.0
+
+
+class DataQualityProfiler:
+    """
+    Validates batches of parsed properties and quarantines bad rows instead of failing the page.
+
+    :param city_bounds: Optional (lat_min, lat_max, long_min, long_max) per Code_City. Cities
+        without an entry are checked against the bounds of India, and against a running
+        centroid of their accepted rows once it has `min_city_samples` of them.
+    :param price_tolerance: Accepted ratio between Price_SqFt and Price / Area_SqFt, either way.
+    :param city_radius_km: Maximum distance from the city centroid.
+    :param min_city_samples: Accepted rows needed before a city's centroid is trusted.
+    :param max_samples: Quarantined rows kept in memory in `quarantine`. Counts cover all of them.
+    :param quarantine_path: Optional JSON lines file every quarantined row is appended to.
+    """
+
+    def __init__(
+        self,
+        city_bounds: Optional[Dict[str, Tuple[float, float, float, float]]] = None,
+        price_tolerance: float = 2.0,
+        city_radius_km: float = 75.0,
+        min_city_samples: int = 30,
+        max_samples: int = 1000,
+        quarantine_path: Optional[str] = None,
+    ):
+        self.city_bounds = city_bounds or {}
+        self.price_tolerance = price_tolerance
+        self.city_radius_km = city_radius_km
+        self.min_city_samples = min_city_samples
+        self.max_samples = max_samples
+        self.quarantine_path = quarantine_path
+
+        self.quarantine: List[Dict[str, Any]] = []
+        self.rows_seen = 0
+        self.rows_validated = 0
+        self.rows_quarantined = 0
+        self.failures: Dict[str, int] = {}
+        self.nulls: Dict[str, int] = {}
+
+        # Running count/mean/M2 of accepted rows per numeric column (Chan et al. parallel update)
+        self._stats: Dict[str, Tuple[int, float, float]] = {col: (0, 0.0, 0.0) for col in RANGES}
+        # Running count/mean latitude/mean longitude of accepted rows per Code_City
+        self._cities: Dict[str, Tuple[int, float, float]] = {}
+
+    @staticmethod
+    def _column(batch: List[Dict], key: str) -> np.ndarray:
+        return np.array([np.nan if row.get(key) is None else row[key] for row in batch], dtype=float)
+
+    def _count(self, check: str, mask: np.ndarray) -> None:
+        self.failures[check] = self.failures.get(check, 0) + int(mask.sum())
+
+    def _quarantine(self, entries: List[Dict[str, Any]]) -> None:
+        self.rows_quarantined += len(entries)
+        self.quarantine.extend(entries[:max(self.max_samples - len(self.quarantine), 0)])
+
+        if self.quarantine_path is not None:
+            with open(self.quarantine_path, "a") as f:
+                f.writelines(json.dumps(entry, default=str) + "\n" for entry in entries)
+
+    def quarantine_error(self, data: Dict, error: Exception) -> None:
+        """Records a row that could not be parsed at all."""
+        self.rows_seen += 1
+        self.failures['parse_error'] = self.failures.get('parse_error', 0) + 1
+        self._quarantine([{'row': data, 'reasons': [f"parse_error: {error}"]}])
+
+    def validate(self, batch: List[Dict]) -> List[Dict]:
+        """
+        Runs all checks over a batch at once.
+
+        :param batch: Parsed properties.
+        :return: The rows that passed. Failed rows are added to `quarantine` with their reasons.
+        """
+        if not batch:
+            return []
+
+        self.rows_seen += len(batch)
+        self.rows_validated += len(batch)
+        checks: Dict[str, np.ndarray] = {}
+
+        for key in batch[0]:
+            nulls = sum(row.get(key) is None for row in batch)
+            self.nulls[key] = self.nulls.get(key, 0) + nulls
+
+        columns = {col: self._column(batch, col) for col in RANGES}
+        for col, (lo, hi) in RANGES.items():
+            values = columns[col]
+            checks[f"range_{col}"] = ~np.isnan(values) & ((values < lo) | (values > hi))
+
+        # Geo-bounds, using per-city bounds where known
+        codes = [row.get('Code_City') for row in batch]
+        lat, lng = self._column(batch, 'Latitude'), self._column(batch, 'Longitude')
+        bounds = np.array([self.city_bounds.get(code, INDIA_BOUNDS) for code in codes], dtype=float)
+        located = ~np.isnan(lat) & ~np.isnan(lng)
+
+        in_bounds = (lat >= bounds[:, 0]) & (lat <= bounds[:, 1]) & (lng >= bounds[:, 2]) & (lng <= bounds[:, 3])
+        swapped = (lng >= bounds[:, 0]) & (lng <= bounds[:, 1]) & (lat >= bounds[:, 2]) & (lat <= bounds[:, 3])
+        checks['geo_swapped'] = located & swapped
+        checks['geo_bounds'] = located & ~in_bounds & ~swapped
+
+        # Cities without explicit bounds: distance from the running centroid of the city's accepted rows
+        centroids = np.array([
+            self._cities.get(code, (0, np.nan, np.nan)) if code not in self.city_bounds else (0, np.nan, np.nan)
+            for code in codes
+        ], dtype=float)
+        trusted = centroids[:, 0] >= self.min_city_samples
+        checks['geo_city_radius'] = located & in_bounds & trusted & (
+            self._distance_km(lat, lng, centroids[:, 1], centroids[:, 2]) > self.city_radius_km
+        )
+
+        # Price, area and price per sq. ft. should agree with each other
+        price, area, price_sqft = columns['Price'], columns['Area_SqFt'], columns['Price_SqFt']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = price_sqft * area / price
+        comparable = np.isfinite(ratio) & (ratio > 0)
+        checks['price_area_mismatch'] = comparable & ((ratio > self.price_tolerance) | (ratio < 1 / self.price_tolerance))
+
+        floor, floor_total = columns['Num_Floor'], columns['Num_Floor_Total']
+        checks['floor_above_total'] = ~np.isnan(floor) & ~np.isnan(floor_total) & (floor > floor_total)
+
+        bad = np.zeros(len(batch), dtype=bool)
+        for check, mask in checks.items():
+            self._count(check, mask)
+            bad |= mask
+
+        self._quarantine([
+            {'row': batch[i], 'reasons': [check for check, mask in checks.items() if mask[i]]}
+            for i in np.flatnonzero(bad)
+        ])
+
+        self._update_stats(columns, ~bad)
+        self._update_cities(codes, lat, lng, ~bad & located)
+
+        if bad.any():
+            log.warning(f"Quarantined {int(bad.sum())} of {len(batch)} rows in batch.")
+
+        return [row for row, ok in zip(batch, ~bad) if ok]
+
+    @staticmethod
+    def _distance_km(lat_a: np.ndarray, lng_a: np.ndarray, lat_b: np.ndarray, lng_b: np.ndarray) -> np.ndarray:
+        # Haversine; NaN centroids give NaN distances, which never compare as too far
+        lat_a, lng_a, lat_b, lng_b = map(np.radians, (lat_a, lng_a, lat_b, lng_b))
+        h = np.sin((lat_b - lat_a) / 2) ** 2 + np.cos(lat_a) * np.cos(lat_b) * np.sin((lng_b - lng_a) / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(h))
+
+    def _update_cities(self, codes: List[Any], lat: np.ndarray, lng: np.ndarray, accepted: np.ndarray) -> None:
+        for code in set(codes[i] for i in np.flatnonzero(accepted)):
+            mask = accepted & np.array([c == code for c in codes])
+            self._merge_city(code, int(mask.sum()), float(lat[mask].mean()), float(lng[mask].mean()))
+
+    def _merge_city(self, code: Any, n_b: int, lat_b: float, lng_b: float) -> None:
+        n_a, lat_a, lng_a = self._cities.get(code, (0, 0.0, 0.0))
+        n = n_a + n_b
+        self._cities[code] = (n, lat_a + (lat_b - lat_a) * n_b / n, lng_a + (lng_b - lng_a) * n_b / n)
+
+    def _merge_stats(self, col: str, n_b: int, mean_b: float, m2_b: float) -> None:
+        n_a, mean_a, m2_a = self._stats[col]
+        n = n_a + n_b
+        delta = mean_b - mean_a
+        self._stats[col] = (n, mean_a + delta * n_b / n, m2_a + m2_b + delta ** 2 * n_a * n_b / n)
+
+    def merge(self, other: 'DataQualityProfiler') -> None:
+        """
+        Folds another profiler's counts and statistics into this one, e.g. from a replay worker.
+        Its quarantined rows are only taken as samples; spilling is left to the profiler that saw them.
+        """
+        self.rows_seen += other.rows_seen
+        self.rows_validated += other.rows_validated
+        self.rows_quarantined += other.rows_quarantined
+        self.quarantine.extend(other.quarantine[:max(self.max_samples - len(self.quarantine), 0)])
+
+        for check, n in other.failures.items():
+            self.failures[check] = self.failures.get(check, 0) + n
+        for col, n in other.nulls.items():
+            self.nulls[col] = self.nulls.get(col, 0) + n
+
+        for col, (n, mean, m2) in other._stats.items():
+            if n:
+                self._merge_stats(col, n, mean, m2)
+        for code, (n, lat, lng) in other._cities.items():
+            self._merge_city(code, n, lat, lng)
+
+    def _update_stats(self, columns: Dict[str, np.ndarray], accepted: np.ndarray) -> None:
+        for col, values in columns.items():
+            values = values[accepted & ~np.isnan(values)]
+            if not values.size:
+                continue
+
+            mean_b = float(values.mean())
+            self._merge_stats(col, values.size, mean_b, float(((values - mean_b) ** 2).sum()))
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'rows_seen': self.rows_seen,
+            'rows_quarantined': self.rows_quarantined,
+            'failures': dict(self.failures),
+            'null_rate': {col: n / self.rows_validated for col, n in self.nulls.items()} if self.rows_validated else {},
+            'columns': {
+                col: {'count': n, 'mean': mean, 'std': (m2 / n) ** 0.5 if n else None}
+                for col, (n, mean, m2) in self._stats.items()
+            },
+        }